@@ -2,18 +2,35 @@ import threading
 from bluetooth import *
 import Queue
 
+import ClientIngress
+
 class BluetoothConnection(threading.Thread):
-    def __init__(self, lightQueue, stateQueue):
+    def __init__(self, lightQueue, stateQueue, rate=50, burst=20, policy=ClientIngress.COALESCE):
         print("Initializing BluetoothConnection thread")
         threading.Thread.__init__(self)
         self.name = "Raspberry_BT_Server"
         self.uuid = "00001101-0000-1000-8000-00805F9B34FB"
-        self.serverSocket = BluetoothSocket(RFCOMM)
+        self.serverSocket = ""
         self.clientSocket = ""
         self.address = ""
         self.lightQueue = lightQueue
         self.stateQueue = stateQueue
 
+        # Limits for how fast a single client may send commands
+        self.rate = rate
+        self.burst = burst
+        self.policy = policy
+        self.clientStats = {} # Counters per client address
+
+        # Set when the service is advertised and we are ready for clients
+        self.ready = threading.Event()
+
+        print("BluetoothConnection thread initialized")
+
+    # Binding and advertising is slow, so it is done from the thread
+    # itself instead of holding up the rest of the startup
+    def setupServer(self):
+        self.serverSocket = BluetoothSocket(RFCOMM)
         self.serverSocket.bind(("", PORT_ANY))
         self.serverSocket.listen(1)
 
@@ -23,28 +40,31 @@ class BluetoothConnection(threading.Thread):
                           profiles = [SERIAL_PORT_PROFILE],
                           protocols = [OBEX_UUID])
 
-        print("BluetoothConnection thread initialized")
+        self.ready.set()
+        print("Service advertised")
 
     def run(self):
+        self.setupServer()
         while True:
             print("Waiting for connection...")
             self.clientSocket, self.address = self.serverSocket.accept()
             print("Accepted connection from ", self.address, " syncing states...")
             self.syncStates()
+            stats = self.clientStats.setdefault(self.address[0], {})
+            ingress = ClientIngress.ClientIngress(self.lightQueue, stats, self.rate, self.burst, self.policy)
             while True:
+                ingress.waitForData(self.clientSocket)
                 try:
                     data = self.clientSocket.recv(1024)
                 except BluetoothError as e:
                     break
 
                 if len(data) == 0: break
-                decoded = data.decode("utf-8")
-                dataList = list(filter(None, decoded.split(";")))
-                for decodedData in dataList:
-                    print("Received from device: ", decodedData)
-                    self.lightQueue.put(decodedData)
+                ingress.receive(data)
 
+            ingress.close()
             self.clientSocket.close()
+            print("Client stats: ", self.address, stats)
             self.lightQueue.put("0_A0000000") # Tell the system to save states
             print("Connection closed... states saved")
 
@@ -0,0 +1,157 @@
+import time
+import select
+import collections
+
+# What to do with commands that arrive faster than the client is allowed
+COALESCE = "coalesce" # Only keep the latest command of each kind
+DROP_OLDEST = "dropOldest" # Keep a short backlog and drop the oldest
+PAUSE = "pause" # Stop reading from the client until there is room
+
+COMMAND_LENGTH = 10 # Every command looks like 2_RRGGBBAA
+
+class TokenBucket():
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.last = time.time()
+
+    def refill(self):
+        now = time.time()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def take(self):
+        self.refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    # Seconds until the next token is available
+    def waitTime(self):
+        self.refill()
+        return max(0, (1 - self.tokens) / self.rate)
+
+class ClientIngress():
+    def __init__(self, lightQueue, stats, rate=50, burst=20, policy=COALESCE, backlog=16, verbose=True):
+        self.lightQueue = lightQueue
+        self.verbose = verbose
+        self.buffer = ""
+        self.bucket = TokenBucket(rate, burst)
+        self.policy = policy
+        self.pending = collections.OrderedDict() # Used when coalescing
+        self.backlog = collections.deque(maxlen=backlog) # Used when dropping
+
+        self.stats = stats
+        for counter in ("received", "forwarded", "coalesced", "dropped", "paused", "refused"):
+            self.stats.setdefault(counter, 0)
+
+    # Split what was read from the client into commands. A command cut in
+    # two by the read is kept until the rest of it arrives
+    def receive(self, data):
+        self.buffer += data.decode("utf-8", "replace")
+        dataList = self.buffer.split(";")
+        self.buffer = dataList.pop()
+        if len(self.buffer) >= COMMAND_LENGTH:
+            dataList.append(self.buffer)
+            self.buffer = ""
+
+        for decodedData in filter(None, dataList):
+            if self.verbose:
+                print("Received from device: ", decodedData)
+            # Internal messages like 0_A save state or 0_C stop the running
+            # effect, a client is never allowed to send those
+            if decodedData[0] == "0":
+                self.stats["refused"] += 1
+                continue
+            self.submit(decodedData)
+        # Everything in this read has had its chance to replace what was
+        # held back, so only the newest is forwarded
+        self.flush()
+
+    # Commands that replace each other share a key, so only the newest matters
+    def commandKey(self, data):
+        if len(data) < 3 or data[0] != "2":
+            return data
+        if data[2] == "K" or data[2] == "L":
+            return "enabled"
+        if data[2] == "O": # Every layer is kept apart
+            return data[2:4]
+        if data[2] == "M": # Every scene slot is kept apart
+            return data[2:5]
+        if data[2] in "GHIJN" or data[2] in "0123456789abcdefABCDEF":
+            return "look"
+        return data[2]
+
+    def isStore(self, data):
+        return len(data) >= 3 and data[0] == "2" and data[2] == "M"
+
+    def submit(self, data):
+        self.stats["received"] += 1
+        if self.policy == PAUSE:
+            # Blocking here stops us reading the socket, so the client is
+            # held back by the transport instead of filling our memory
+            while not self.bucket.take():
+                self.stats["paused"] += 1
+                time.sleep(self.bucket.waitTime())
+            self.forward(data)
+        elif self.policy == DROP_OLDEST:
+            if len(self.backlog) == self.backlog.maxlen:
+                self.stats["dropped"] += 1
+            self.backlog.append(data)
+        else:
+            # Storing a scene has to see every command sent before it
+            if self.isStore(data):
+                self.wait()
+            key = self.commandKey(data)
+            if key in self.pending:
+                self.stats["coalesced"] += 1
+                del self.pending[key]
+            self.pending[key] = data
+
+    # Forward as many held back commands as the bucket allows. While the
+    # light queue is full they stay here, where newer commands can still
+    # replace them
+    def flush(self):
+        while len(self.backlog) > 0 and not self.lightQueue.full() and self.bucket.take():
+            self.forward(self.backlog.popleft())
+        while len(self.pending) > 0 and not self.lightQueue.full() and self.bucket.take():
+            self.forward(self.pending.popitem(last=False)[1])
+
+    # Wait until the client socket can be read, forwarding held back
+    # commands as tokens come in. The socket keeps being read meanwhile, so
+    # newer commands can still replace or push out the held back ones
+    def waitForData(self, clientSocket):
+        while True:
+            self.flush()
+            if len(self.backlog) == 0 and len(self.pending) == 0:
+                timeout = None
+            elif self.lightQueue.full():
+                timeout = 1 / self.bucket.rate
+            else:
+                timeout = self.bucket.waitTime()
+            if len(select.select([clientSocket], [], [], timeout)[0]) > 0:
+                return
+
+    # Forward everything that is held back before going on
+    def wait(self):
+        while len(self.backlog) > 0 or len(self.pending) > 0:
+            if self.lightQueue.full():
+                time.sleep(1 / self.bucket.rate)
+            else:
+                time.sleep(self.bucket.waitTime())
+            self.flush()
+
+    # Forward whatever is left when the client disconnects
+    def close(self):
+        while len(self.backlog) > 0:
+            self.forward(self.backlog.popleft())
+        while len(self.pending) > 0:
+            self.forward(self.pending.popitem(last=False)[1])
+
+    # Never take anything out of the light queue to make room, it is shared
+    # with the save state and DMX messages
+    def forward(self, data):
+        self.lightQueue.put(data)
+        self.stats["forwarded"] += 1
@@ -0,0 +1,149 @@
+import select
+import socket
+import struct
+import threading
+
+ARTNET_PORT = 6454
+SACN_PORT = 5568
+
+ARTNET_HEADER = b"Art-Net\x00"
+ARTNET_OP_DMX = 0x5000
+ARTNET_DATA = 18 # Where the DMX data starts in an ArtDmx packet
+
+SACN_IDENTIFIER = b"ASC-E1.17\x00\x00\x00"
+SACN_DATA = 126 # Where the DMX data starts in an E1.31 data packet
+SACN_PREVIEW = 0x80 # Packets meant for a visualizer, not for lights
+
+CHANNELS_PER_UNIVERSE = 510 # 170 RGB fixtures, so none is split over two universes
+
+# Listens for Art-Net and sACN (E1.31) packets and keeps the last DMX data of
+# every universe we are patched to. Packets are read into one preallocated
+# buffer and copied into the universe buffers, so receiving allocates nothing.
+# LightControl applies the data in its "dmx" mode, at its own frame rate.
+class DmxInput(threading.Thread):
+    def __init__(self, lightQueue, fixtures, universe=1, address=1, artnetUniverse=0, artnetPort=ARTNET_PORT, sacnPort=SACN_PORT, fps=50):
+        print("Initializing DmxInput thread")
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.lightQueue = lightQueue
+        self.universe = universe # First sACN universe
+        self.artnetUniverse = artnetUniverse # First Art-Net port address
+        self.frameTime = 1.0 / fps
+
+        self.active = False # Set by LightControl while it follows DMX
+        self.requested = False
+        self.packets = 0
+        self.changes = 0
+
+        # Fixtures take three channels each, starting at the DMX address
+        self.patch = []
+        for i in range(len(fixtures)):
+            channel = address - 1 + 3 * i
+            universeIndex = channel // CHANNELS_PER_UNIVERSE
+            offset = channel % CHANNELS_PER_UNIVERSE
+            while len(self.patch) <= universeIndex:
+                self.patch.append([])
+            for c in range(3):
+                self.patch[universeIndex].append((offset + c, fixtures[i][c]))
+
+        self.universes = [bytearray(512) for patch in self.patch]
+        self.universeViews = [memoryview(data) for data in self.universes]
+        self.changed = [False for patch in self.patch]
+        self.applied = [bytearray(512) for patch in self.patch]
+
+        self.receiveBuffer = bytearray(SACN_DATA + 512)
+        self.receiveView = memoryview(self.receiveBuffer)
+
+        self.artnetSocket = self.openSocket(artnetPort)
+        self.sacnSocket = self.openSocket(sacnPort)
+        for universeIndex in range(len(self.patch)):
+            group = "239.255.{}.{}".format((universe + universeIndex) >> 8, (universe + universeIndex) & 0xFF)
+            try:
+                self.sacnSocket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                                           struct.pack("4s4s", socket.inet_aton(group), socket.inet_aton("0.0.0.0")))
+            except socket.error as e:
+                print("Could not join sACN multicast group ", group, ": ", e)
+
+        print("DmxInput thread initialized, patched to ", len(self.patch), " universe(s)")
+
+    def openSocket(self, port):
+        udpSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        udpSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        udpSocket.bind(("", port))
+        return udpSocket
+
+    def run(self):
+        print("Starting DmxInput thread")
+        sockets = [self.artnetSocket, self.sacnSocket]
+        while True:
+            readable = select.select(sockets, [], [], 1)[0]
+            for udpSocket in readable:
+                try:
+                    length = udpSocket.recv_into(self.receiveView)
+                except socket.error:
+                    continue
+                if udpSocket is self.artnetSocket:
+                    self.receiveArtnet(length)
+                else:
+                    self.receiveSacn(length)
+
+    def receiveArtnet(self, length):
+        data = self.receiveBuffer
+        if length < ARTNET_DATA or self.receiveView[0:8] != ARTNET_HEADER:
+            return
+        if data[8] | (data[9] << 8) != ARTNET_OP_DMX:
+            return
+        universe = data[14] | (data[15] << 8)
+        count = min((data[16] << 8) | data[17], length - ARTNET_DATA, 512)
+        self.store(universe - self.artnetUniverse, ARTNET_DATA, count)
+
+    def receiveSacn(self, length):
+        data = self.receiveBuffer
+        if length < SACN_DATA or self.receiveView[4:16] != SACN_IDENTIFIER:
+            return
+        if data[112] & SACN_PREVIEW or data[125] != 0: # Only plain DMX data
+            return
+        universe = (data[113] << 8) | data[114]
+        count = min(((data[123] << 8) | data[124]) - 1, length - SACN_DATA, 512)
+        self.store(universe - self.universe, SACN_DATA, count)
+
+    # Copy the packet into its universe if anything in it changed
+    def store(self, universeIndex, start, count):
+        if universeIndex < 0 or universeIndex >= len(self.universes) or count <= 0:
+            return
+        self.packets += 1
+        if self.receiveView[start:start + count] == self.universeViews[universeIndex][0:count]:
+            return
+
+        self.universeViews[universeIndex][0:count] = self.receiveView[start:start + count]
+        self.changed[universeIndex] = True
+        self.changes += 1
+
+        # Ask LightControl to follow us, unless it already does
+        if not self.active and not self.requested:
+            self.requested = True
+            self.lightQueue.put("0_B0000000")
+
+    # Write the channels that changed since the last call. Called from
+    # LightControl every frame while it is in "dmx" mode
+    def apply(self, pi):
+        for universeIndex in range(len(self.patch)):
+            if not self.changed[universeIndex]:
+                continue
+            self.changed[universeIndex] = False
+            data = self.universes[universeIndex]
+            applied = self.applied[universeIndex]
+            for offset, pin in self.patch[universeIndex]:
+                if data[offset] != applied[offset]:
+                    applied[offset] = data[offset]
+                    pi.set_PWM_dutycycle(pin, data[offset])
+
+    # Write every patched channel, for when LightControl takes over from an effect
+    def applyAll(self, pi):
+        for universeIndex in range(len(self.patch)):
+            self.changed[universeIndex] = False
+            data = self.universes[universeIndex]
+            applied = self.applied[universeIndex]
+            for offset, pin in self.patch[universeIndex]:
+                applied[offset] = data[offset]
+                pi.set_PWM_dutycycle(pin, data[offset])
@@ -0,0 +1,110 @@
+import argparse
+import os
+import shutil
+import socket
+import struct
+import tempfile
+import time
+import Queue
+
+import DmxInput
+import FakePi
+import LightControl
+
+# Sends Art-Net or sACN packets with a moving chase to a local DmxInput and
+# LightControl running on a FakePi, then reports how steady the DMX frame
+# rate stayed and how many channels were written.
+#
+#   python DmxSender.py --protocol sacn --rate 44 --pixels 170 --duration 5
+
+def artnetPacket(universe, sequence, data):
+    return (DmxInput.ARTNET_HEADER + struct.pack("<H", DmxInput.ARTNET_OP_DMX) +
+            struct.pack(">HBB", 14, sequence, 0) + struct.pack("<H", universe) + struct.pack(">H", len(data)) + bytes(data))
+
+def sacnPacket(universe, sequence, data):
+    count = len(data) + 1 # Including the start code
+    root = (struct.pack(">HH", 0x0010, 0) + DmxInput.SACN_IDENTIFIER +
+            struct.pack(">HI", 0x7000 | (109 + count), 0x00000004) + b"\x00" * 16)
+    framing = (struct.pack(">HI", 0x7000 | (87 + count), 0x00000002) + b"DmxSender".ljust(64, b"\x00") +
+               struct.pack(">BHBBH", 100, 0, sequence, 0, universe))
+    dmp = struct.pack(">HBBHHHB", 0x7000 | (10 + count), 0x02, 0xA1, 0, 1, count, 0)
+    return root + framing + dmp + bytes(data)
+
+# DmxInput that notes the time of every frame LightControl applies
+class RecordingDmxInput(DmxInput.DmxInput):
+    def __init__(self, *args, **kwargs):
+        DmxInput.DmxInput.__init__(self, *args, **kwargs)
+        self.frames = []
+
+    def apply(self, pi):
+        self.frames.append(time.time())
+        DmxInput.DmxInput.apply(self, pi)
+
+def main():
+    parser = argparse.ArgumentParser(description="Send Art-Net/sACN to a local DmxInput")
+    parser.add_argument("--protocol", default="artnet", choices=["artnet", "sacn"])
+    parser.add_argument("--rate", type=float, default=44, help="Packets per second per universe")
+    parser.add_argument("--pixels", type=int, default=170, help="RGB fixtures to patch")
+    parser.add_argument("--duration", type=float, default=5)
+    args = parser.parse_args()
+
+    pi = FakePi.FakePi(history=10)
+    lightQueue = Queue.Queue(64)
+    fixtures = [(2000 + 3 * i, 2001 + 3 * i, 2002 + 3 * i) for i in range(args.pixels)]
+    # Keep the state and scenes of the device out of the test
+    tempDir = tempfile.mkdtemp()
+    lightControl = LightControl.LightControl(pi, lightQueue, Queue.Queue(), fixtures, os.path.join(tempDir, "lightstate.txt"),
+                                             os.path.join(tempDir, "scenes.json"))
+    lightControl.daemon = True
+    dmxInput = RecordingDmxInput(lightQueue, fixtures, artnetPort=0, sacnPort=0)
+    lightControl.dmxInput = dmxInput
+    dmxInput.start()
+    lightControl.start()
+
+    if args.protocol == "artnet":
+        port = dmxInput.artnetSocket.getsockname()[1]
+        packet = artnetPacket
+        firstUniverse = dmxInput.artnetUniverse
+    else:
+        port = dmxInput.sacnSocket.getsockname()[1]
+        packet = sacnPacket
+        firstUniverse = dmxInput.universe
+
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    universes = [bytearray(512) for patch in dmxInput.patch]
+    sent = 0
+    startTime = time.time()
+    nextTime = startTime
+    while time.time() - startTime < args.duration:
+        # Move a single lit fixture along the patch
+        for universeIndex in range(len(universes)):
+            data = universes[universeIndex]
+            for i in range(len(data)):
+                data[i] = 0
+            lit = (sent // len(universes)) % DmxInput.CHANNELS_PER_UNIVERSE // 3 * 3
+            data[lit] = 255
+            sender.sendto(packet(firstUniverse + universeIndex, sent % 256, data), ("127.0.0.1", port))
+            sent += 1
+        nextTime += 1.0 / args.rate
+        time.sleep(max(0, nextTime - time.time()))
+    elapsed = time.time() - startTime
+    time.sleep(.2)
+    lightQueue.put("0_C0000000") # Stop following DMX
+    lightControl.effectStopped.wait(10)
+    shutil.rmtree(tempDir)
+
+    frames = [frame for frame in dmxInput.frames if frame <= startTime + elapsed]
+    intervals = sorted((frames[i] - frames[i - 1]) * 1000 for i in range(1, len(frames)))
+    writes = pi.counts["set_PWM_dutycycle"]
+
+    print("")
+    print("Protocol: {}, {} fixtures over {} universe(s), {:.1f} s".format(args.protocol, args.pixels, len(universes), elapsed))
+    print("Packets sent: {} ({:.0f}/s), received: {}, with changes: {}".format(sent, sent / elapsed, dmxInput.packets, dmxInput.changes))
+    if len(intervals) > 0:
+        print("Frames: {} ({:.1f}/s), interval p50 {:.1f} ms, p99 {:.1f} ms, max {:.1f} ms".format(
+            len(frames), len(frames) / elapsed, intervals[len(intervals) // 2],
+            intervals[min(len(intervals) - 1, int(len(intervals) * .99))], intervals[-1]))
+    print("Pin writes: {} ({:.0f}/s)".format(writes, writes / elapsed))
+
+if __name__ == '__main__':
+    main()
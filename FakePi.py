@@ -0,0 +1,52 @@
+import time
+import threading
+import collections
+
+# Stands in for pigpio.pi() when there is no Raspberry Pi around. Every call
+# is recorded with the time it was made, so tests and tools can check what
+# would have been written to the pins
+class FakePi():
+    def __init__(self, history=100000):
+        self.calls = collections.deque(maxlen=history) # (time, name, args)
+        self.counts = collections.defaultdict(int)
+        self.duty = {}
+        self.frequency = {}
+        self.spi = [] # The last frame written to every SPI handle
+        self.lock = threading.Lock()
+
+    def record(self, name, *args):
+        with self.lock:
+            self.calls.append((time.time(), name, args))
+            self.counts[name] += 1
+
+    def set_mode(self, gpio, mode):
+        self.record("set_mode", gpio, mode)
+
+    def set_PWM_frequency(self, gpio, frequency):
+        self.record("set_PWM_frequency", gpio, frequency)
+        self.frequency[gpio] = frequency
+        return frequency
+
+    def set_PWM_dutycycle(self, gpio, dutycycle):
+        self.record("set_PWM_dutycycle", gpio, dutycycle)
+        self.duty[gpio] = int(dutycycle)
+
+    def get_PWM_dutycycle(self, gpio):
+        return self.duty.get(gpio, 0)
+
+    # Acts as the SPI sink for PixelStrip
+    def spi_open(self, channel, baud, flags):
+        self.record("spi_open", channel, baud, flags)
+        self.spi.append(bytearray())
+        return len(self.spi) - 1
+
+    def spi_write(self, handle, data):
+        self.record("spi_write", handle, len(data))
+        self.spi[handle][:] = data # Reuses the buffer once the size is known
+        return len(data)
+
+    def spi_close(self, handle):
+        self.record("spi_close", handle)
+
+    def stop(self):
+        self.record("stop")
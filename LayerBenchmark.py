@@ -0,0 +1,50 @@
+import sys
+import time
+
+import LayerStack
+
+# Measures how long compositing a frame takes for a growing number of layers,
+# with numpy where it is installed and with plain Python
+#
+#   python LayerBenchmark.py [seconds per run]
+
+FIXTURES = (1, LayerStack.NUMPY_FIXTURES, 150, 1200)
+
+# Layers to stack, cycling through the effects and blend modes
+def layers(count):
+    stack = []
+    for i in range(count):
+        effect = LayerStack.EFFECTS[1 + i % (len(LayerStack.EFFECTS) - 1)]
+        blend = LayerStack.BLENDS[i % len(LayerStack.BLENDS)] if i > 0 else LayerStack.NORMAL
+        stack.append(LayerStack.Layer(effect, [(255, 128, 0)], 200, blend, 64))
+    return stack
+
+def benchmark(fixtures, layerCount, seconds, vectorize):
+    layerStack = LayerStack.LayerStack(fixtures, vectorize=vectorize)
+    for i, layer in enumerate(layers(layerCount)):
+        layerStack.layers[i] = layer
+    layerStack.setMaster(200)
+
+    frames = 0
+    startTime = time.time()
+    while time.time() - startTime < seconds:
+        layerStack.render(frames / 100.0)
+        frames += 1
+    return (time.time() - startTime) * 1000 / frames
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else .5
+    backends = [("python", False)]
+    if LayerStack.loadNumpy() is not None:
+        backends.insert(0, ("numpy", True))
+
+    print("{:<8} {:>8} {}".format("backend", "fixtures", " ".join("{:>7}".format("{} lyr".format(n)) for n in range(1, 9))))
+    for name, vectorize in backends:
+        for fixtures in FIXTURES:
+            times = [benchmark(fixtures, layerCount, seconds, vectorize) for layerCount in range(1, 9)]
+            print("{:<8} {:>8} {}".format(name, fixtures, " ".join("{:>7.3f}".format(ms) for ms in times)))
+    print("Milliseconds per frame, the master layer is always composited on top")
+    print("Stacks with {} fixtures or more use numpy".format(LayerStack.NUMPY_FIXTURES))
+
+if __name__ == '__main__':
+    main()
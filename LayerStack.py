@@ -0,0 +1,163 @@
+import math
+
+# numpy composites all fixtures at once, but importing it costs boot time
+# and memory. Below NUMPY_FIXTURES plain Python composites a frame well
+# within the 10 ms solid has for it, so numpy is only imported by the first
+# stack with at least that many fixtures
+numpy = None
+NUMPY_FIXTURES = 16
+
+# Import numpy the first time it is needed, None when it is not installed
+def loadNumpy():
+    global numpy
+    if numpy is None:
+        try:
+            import numpy
+        except ImportError:
+            return None
+    return numpy
+
+NORMAL = "normal"
+ADD = "add"
+MULTIPLY = "multiply"
+MAX = "max"
+BLENDS = (NORMAL, ADD, MULTIPLY, MAX) # In the order used by the 2_O command
+
+SOLID = "solid"
+RAINBOW = "rainbow"
+STROBE = "strobe"
+PULSE = "pulse"
+EFFECTS = ("", SOLID, RAINBOW, STROBE, PULSE) # In the order used by the 2_O command, "" removes the layer
+
+STROBE_ON = .03 # Seconds the strobe is lit in every period
+
+class Layer():
+    def __init__(self, effect, colors, opacity=255, blend=NORMAL, speed=0):
+        self.effect = effect
+        self.opacity = opacity
+        self.blend = blend
+        self.speed = speed
+        # A single color for every fixture, or one color per fixture
+        self.colors = [list(color) for color in colors]
+        self.array = None # The colors as a numpy array, made when first used
+
+    # Rainbow cycles, pulses or strobe flashes per second
+    def frequency(self):
+        if self.effect == STROBE:
+            return 1 + self.speed / 16.0
+        return self.speed / 64.0
+
+# A stack of layers that are composited into one color per fixture. Layers
+# are blended from the bottom up, and the master layer multiplies the result
+# last, so it works as the brightness fader for everything below it
+class LayerStack():
+    def __init__(self, count, slots=8, vectorize=None):
+        self.count = count
+        self.layers = [None] * slots
+        self.master = Layer(SOLID, [(255, 255, 255)], blend=MULTIPLY)
+
+        if vectorize is None:
+            vectorize = count >= NUMPY_FIXTURES
+        self.numpy = loadNumpy() if vectorize else None
+
+        # Where every fixture is along the strip, from 0 to 1
+        numpy = self.numpy
+        if numpy is not None:
+            self.positions = (numpy.arange(count) / float(count)).reshape(-1, 1)
+            self.hueOffset = numpy.array([3.0, 2.0, 4.0])
+            self.hueSign = numpy.array([1.0, -1.0, -1.0])
+            self.hueShift = numpy.array([-1.0, 2.0, 2.0])
+            self.white = numpy.full((1, 3), 255.0)
+            self.black = numpy.zeros((1, 3))
+            self.output = numpy.zeros((count, 3))
+        else:
+            self.positions = [i / float(count) for i in range(count)]
+            self.output = [[0.0, 0.0, 0.0] for i in range(count)]
+
+    def setMaster(self, level):
+        if self.master.colors[0][0] != level:
+            self.master.colors[0] = [level, level, level]
+            self.master.array = None
+
+    # Composite every layer at time t, in seconds. Returns one [r, g, b] of
+    # ints per fixture
+    def render(self, t):
+        if self.numpy is not None:
+            return self.renderNumpy(t)
+        return self.renderPython(t)
+
+    def renderNumpy(self, t):
+        numpy = self.numpy
+        output = self.output
+        output.fill(0)
+        for layer in self.layers + [self.master]:
+            if layer is None or layer.opacity == 0:
+                continue
+
+            source = self.effectNumpy(layer, t)
+            if layer.blend == ADD:
+                blended = numpy.minimum(output + source, 255)
+            elif layer.blend == MULTIPLY:
+                blended = output * source / 255.0
+            elif layer.blend == MAX:
+                blended = numpy.maximum(output, source)
+            else:
+                blended = source
+
+            if layer.opacity >= 255:
+                output[...] = blended
+            else:
+                output += (blended - output) * (layer.opacity / 255.0)
+        return numpy.rint(output).astype(int).tolist()
+
+    def effectNumpy(self, layer, t):
+        numpy = self.numpy
+        if layer.array is None:
+            layer.array = numpy.array(layer.colors, dtype=float).reshape(-1, 3)
+        if layer.effect == RAINBOW:
+            hue = (self.positions + t * layer.frequency()) % 1.0 * 6
+            return numpy.clip(numpy.abs(hue - self.hueOffset) * self.hueSign + self.hueShift, 0, 1) * 255
+        elif layer.effect == STROBE:
+            return self.white if t % (1.0 / layer.frequency()) < STROBE_ON else self.black
+        elif layer.effect == PULSE:
+            return layer.array * ((1 - math.cos(2 * math.pi * t * layer.frequency())) / 2)
+        return layer.array
+
+    def renderPython(self, t):
+        output = self.output
+        for i in range(self.count):
+            output[i][0] = output[i][1] = output[i][2] = 0.0
+        for layer in self.layers + [self.master]:
+            if layer is None or layer.opacity == 0:
+                continue
+
+            opacity = min(layer.opacity, 255) / 255.0
+            for i in range(self.count):
+                source = self.effectPython(layer, t, i)
+                for c in range(3):
+                    if layer.blend == ADD:
+                        blended = min(output[i][c] + source[c], 255)
+                    elif layer.blend == MULTIPLY:
+                        blended = output[i][c] * source[c] / 255.0
+                    elif layer.blend == MAX:
+                        blended = max(output[i][c], source[c])
+                    else:
+                        blended = source[c]
+                    output[i][c] += (blended - output[i][c]) * opacity
+        return [[int(round(value)) for value in color] for color in output]
+
+    def effectPython(self, layer, t, i):
+        if layer.effect == RAINBOW:
+            hue = (self.positions[i] + t * layer.frequency()) % 1.0 * 6
+            return (min(max(abs(hue - 3) - 1, 0), 1) * 255,
+                    min(max(2 - abs(hue - 2), 0), 1) * 255,
+                    min(max(2 - abs(hue - 4), 0), 1) * 255)
+        elif layer.effect == STROBE:
+            level = 255 if t % (1.0 / layer.frequency()) < STROBE_ON else 0
+            return (level, level, level)
+
+        color = layer.colors[i] if len(layer.colors) > 1 else layer.colors[0]
+        if layer.effect == PULSE:
+            level = (1 - math.cos(2 * math.pi * t * layer.frequency())) / 2
+            return (color[0] * level, color[1] * level, color[2] * level)
+        return color
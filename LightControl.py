@@ -1,9 +1,12 @@
 import threading
-import pigpio
 import time
+import os
+
+import SceneStore
+import LayerStack
 
 class LightControl(threading.Thread):
-    def __init__(self, pi, receiveQueue, stateQueue):
+    def __init__(self, pi, receiveQueue, stateQueue, fixtures=None, stateFile=None, sceneFile=None):
         print("Initializing LightControl thread")
         threading.Thread.__init__(self)
         # Initialize all members
@@ -19,20 +22,44 @@ class LightControl(threading.Thread):
         self.mode = ""
         self.enabled = True
 
-        # Set pins to output mode
-        self.pi.set_mode(self.pinR, pigpio.OUTPUT)
-        self.pi.set_mode(self.pinG, pigpio.OUTPUT)
-        self.pi.set_mode(self.pinB, pigpio.OUTPUT)
-
-        # Set the PWM frequency to be used
-        self.pi.set_PWM_frequency(self.pinR, 200)
-        self.pi.set_PWM_frequency(self.pinG, 200)
-        self.pi.set_PWM_frequency(self.pinB, 200)
-
-        # Initialize all pins with a dutycycle of 0 = off
-        self.pi.set_PWM_dutycycle(self.pinR, 0)
-        self.pi.set_PWM_dutycycle(self.pinG, 0)
-        self.pi.set_PWM_dutycycle(self.pinB, 0)
+        # Every fixture is a set of red, green and blue pins
+        if fixtures is None:
+            fixtures = [(self.pinR, self.pinG, self.pinB)]
+        self.fixtures = fixtures
+
+        # Layers composited by solid, with the solid color as the bottom layer
+        self.layerStack = LayerStack.LayerStack(len(self.fixtures))
+        self.layerStack.layers[0] = LayerStack.Layer(LayerStack.SOLID, [(0, 0, 0)])
+
+        # Art-Net/sACN input to follow in "dmx" mode, if enabled
+        self.dmxInput = None
+
+        # Stored scenes and the one currently being recalled
+        if sceneFile is None:
+            sceneFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scenes.json")
+        self.scenes = SceneStore.SceneStore(sceneFile, self.fixtures)
+        self.scene = ""
+        self.sceneDuty = []
+        self.fadeStart = []
+        self.fadeTime = 0
+        self.recallCount = 0
+        self.modeLock = threading.Lock()
+
+        # Held while writing the pins of one frame. A pixel strip sends its
+        # frames from another thread and uses this to never send half of one,
+        # PWM pins have no frames so they get a lock nobody else takes
+        self.frameLock = getattr(pi, "frameLock", threading.RLock())
+
+        # Where the last state is kept between restarts
+        if stateFile is None:
+            stateFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lightstate.txt")
+        self.stateFile = stateFile
+
+        # Set when the pins are configured and the last state is restored
+        self.lightReady = threading.Event()
+
+        # Set when a 0_C message has stopped the running effect
+        self.effectStopped = threading.Event()
         
         self.functionThread = ""
         self.receiveQueue = receiveQueue
@@ -42,31 +69,94 @@ class LightControl(threading.Thread):
 
     def run(self):
         print("Starting LightControl thread")
+        self.setupPins()
+        self.restoreState()
+        self.lightReady.set()
+        self.scenes.load()
         while True:
             data = self.receiveQueue.get()
-            if data[0] == "2": # Indicates data is for us
-                if data[2] == "G": # Indicates flash
-                    self.setMode("flash")
-                    self.aVal = int(data[8:10], 16)
-                elif data[2] == "H": # Indicates strobe
-                    self.setMode("strobe")
-                    self.aVal = int(data[8:10], 16)
-                elif data[2] == "I": # Indicates fade
-                    self.setMode("fade")
-                    self.aVal = int(data[8:10], 16)
-                elif data[2] == "J": # Indicates smooth
-                    self.setMode("smooth")
-                    self.aVal = int(data[8:10], 16)
-                elif data[2] == "K": # Indicates on
-                    self.enabled = True
-                elif data[2] == "L": # Indicates off
-                    self.enabled = False
-                else: # If none of the above, default to solid color
-                    self.setColor(data[2:4], data[4:6], data[6:8], data[8:10])
+            try:
+                self.handleData(data)
+            except (ValueError, IndexError):
+                print("Ignoring malformed command: ", data)
+
+    def setupPins(self):
+        # Set the PWM frequency to be used. The pins are switched to output
+        # mode by the first set_PWM_dutycycle, so no set_mode is needed
+        self.pi.set_PWM_frequency(self.pinR, 200)
+        self.pi.set_PWM_frequency(self.pinG, 200)
+        self.pi.set_PWM_frequency(self.pinB, 200)
+
+    def handleData(self, data):
+        if data[0] == "2": # Indicates data is for us
+            if data[2] == "G": # Indicates flash
+                self.setMode("flash")
+                self.aVal = int(data[8:10], 16)
+            elif data[2] == "H": # Indicates strobe
+                self.setMode("strobe")
+                self.aVal = int(data[8:10], 16)
+            elif data[2] == "I": # Indicates fade
+                self.setMode("fade")
+                self.aVal = int(data[8:10], 16)
+            elif data[2] == "J": # Indicates smooth
+                self.setMode("smooth")
+                self.aVal = int(data[8:10], 16)
+            elif data[2] == "K": # Indicates on
+                self.enabled = True
+            elif data[2] == "L": # Indicates off
+                self.enabled = False
+            elif data[2] == "M": # Indicates store scene
+                self.storeScene(int(data[3:5], 16))
+            elif data[2] == "N": # Indicates recall scene
+                self.recallScene(int(data[3:5], 16), int(data[8:10], 16) / 10.0)
+            elif data[2] == "O": # Indicates layer
+                if self.setLayer(int(data[3], 16), int(data[4], 16), int(data[5], 16), int(data[6:8], 16), int(data[8:10], 16)):
                     self.setMode("solid")
-            elif data[0] == "0": # Indicates data is for some internal message
-                if data[2] == "A": # Indicates user has disconnected
-                    self.stateQueue.put(self.getMode())
+            else: # If none of the above, default to solid color
+                self.setColor(data[2:4], data[4:6], data[6:8], data[8:10])
+                self.layerStack.layers[0] = LayerStack.Layer(LayerStack.SOLID, [(self.rVal, self.gVal, self.bVal)])
+                self.setMode("solid")
+        elif data[0] == "0": # Indicates data is for some internal message
+            if data[2] == "A": # Indicates user has disconnected
+                state = self.getMode()
+                self.stateQueue.put(state)
+                self.saveState(state)
+            elif data[2] == "B" and self.dmxInput is not None: # Indicates new DMX data
+                self.setMode("dmx")
+            elif data[2] == "C": # Indicates the running effect should stop
+                self.setMode("")
+                self.effectStopped.set()
+
+    # Write the state to disk so it can be restored on the next boot
+    def saveState(self, state):
+        try:
+            with open(self.stateFile, "w") as f:
+                f.write(state.lstrip(";") + "\n")
+                f.write("2_K00000000\n" if self.enabled else "2_L00000000\n")
+        except (IOError, OSError) as e:
+            print("Could not save state: ", e)
+
+    # Replay the saved state, or turn the pins off if there is none
+    def restoreState(self):
+        try:
+            with open(self.stateFile) as f:
+                saved = [line.strip() for line in f if line.strip()]
+        except (IOError, OSError):
+            saved = []
+
+        if len(saved) == 0:
+            self.pi.set_PWM_dutycycle(self.pinR, 0)
+            self.pi.set_PWM_dutycycle(self.pinG, 0)
+            self.pi.set_PWM_dutycycle(self.pinB, 0)
+            return
+
+        # Apply on/off first so the effect starts in the right state
+        for data in reversed(saved):
+            try:
+                self.handleData(data)
+            except (ValueError, IndexError):
+                print("Ignoring bad saved state: ", data)
+        print("State restored: ", saved)
 
     def setColor(self, red, green, blue, alpha):
         self.aVal = int(alpha, 16)
@@ -74,20 +164,117 @@ class LightControl(threading.Thread):
         self.gVal = int(green, 16)
         self.bVal = int(blue, 16)
 
+    # Store the current state as a scene
+    def storeScene(self, number):
+        mode = self.mode
+        if mode == "scene":
+            mode = self.scene["mode"]
+        color = [self.rVal, self.gVal, self.bVal]
+        alpha = self.aVal
+        fixtures = [color for fixture in self.fixtures]
+        if mode == "solid":
+            # The solid color can differ per fixture, like after recalling
+            # a scene taken from DMX
+            colors = self.layerStack.layers[0].colors
+            if len(colors) != len(self.fixtures):
+                colors = [colors[0]] * len(self.fixtures)
+            fixtures = [list(fixtureColor) for fixtureColor in colors]
+            color = fixtures[0]
+        # The layers above the solid color, by slot
+        layers = {}
+        for slot in range(1, len(self.layerStack.layers)):
+            layer = self.layerStack.layers[slot]
+            if layer is not None:
+                layers[str(slot)] = {
+                    "effect": layer.effect,
+                    "colors": layer.colors,
+                    "opacity": layer.opacity,
+                    "blend": layer.blend,
+                    "speed": layer.speed
+                }
+        if mode == "dmx":
+            # Keep what the console is showing as a solid scene, with the
+            # first fixture as the color the phone gets to see
+            mode = "solid"
+            alpha = 255
+            fixtures = [[self.pi.get_PWM_dutycycle(pin) for pin in fixture] for fixture in self.fixtures]
+            color = fixtures[0]
+            layers = {}
+        self.scenes.store(number, {
+            "mode": mode,
+            "color": color,
+            "alpha": alpha,
+            "enabled": self.enabled,
+            "fixtures": fixtures,
+            "layers": layers
+        })
+        print("Scene stored: ", number)
+
+    # Recall a stored scene, fading from the current output over fadeTime seconds
+    def recallScene(self, number, fadeTime):
+        stored = self.scenes.get(number)
+        if stored is None:
+            print("No scene stored as ", number)
+            return
+
+        self.scene, self.sceneDuty = stored
+        self.fadeTime = fadeTime
+
+        # Read the output before the running effect stops and clears the pins
+        if fadeTime > 0:
+            self.fadeStart = [self.pi.get_PWM_dutycycle(pin) for pin, value in self.sceneDuty]
+
+        self.rVal, self.gVal, self.bVal = self.scene["color"]
+        self.aVal = self.scene["alpha"]
+        self.enabled = self.scene["enabled"]
+
+        # Bring back the layers the scene had, and only those. Scenes of
+        # other effects keep the solid color there is
+        layers = self.scenes.layers(self.scene, len(self.layerStack.layers))
+        if layers[0] is None:
+            layers[0] = self.layerStack.layers[0]
+        self.layerStack.layers[:] = layers
+
+        # Make a scene that is already fading stop, so the new one can start
+        self.recallCount += 1
+        if self.mode == "scene":
+            self.mode = ""
+        self.setMode("scene")
+
+    # Set one of the layers composited by solid, effect 0 removes it.
+    # Solid and pulse layers use the current color. Slot 0 is the solid
+    # color itself, so only the layers above it can be set. Returns whether
+    # the layer was set
+    def setLayer(self, slot, effect, blend, speed, opacity):
+        if slot < 1 or slot >= len(self.layerStack.layers) or effect >= len(LayerStack.EFFECTS) or blend >= len(LayerStack.BLENDS):
+            print("Ignoring bad layer: ", slot, effect, blend)
+            return False
+
+        if effect == 0:
+            self.layerStack.layers[slot] = None
+        else:
+            self.layerStack.layers[slot] = LayerStack.Layer(LayerStack.EFFECTS[effect], [(self.rVal, self.gVal, self.bVal)],
+                                                            opacity, LayerStack.BLENDS[blend], speed)
+        return True
+
     # Return the currently selected mode or color in hex
     def getMode(self):
         rReturn = "0x{:02x}".format(int(self.rVal))[2:]
         gReturn = "0x{:02x}".format(int(self.gVal))[2:]
         bReturn = "0x{:02x}".format(int(self.bVal))[2:]
         aReturn = "0x{:02x}".format(int(self.aVal))[2:]
+
+        mode = self.mode
+        if mode == "scene":
+            mode = self.scene["mode"]
         
-        if self.mode == "flash":
+        if mode == "flash":
             return ";2_G00000" + aReturn
-        elif self.mode == "strobe":
+        elif mode == "strobe":
             return ";2_H00000" + aReturn
-        elif self.mode == "fade":
+        elif mode == "fade":
             return ";2_I00000" + aReturn
-        elif self.mode == "smooth":
+        elif mode == "smooth":
             return ";2_J00000" + aReturn
         else:
             return ";2_" + rReturn + gReturn + bReturn + aReturn
@@ -95,7 +282,8 @@ class LightControl(threading.Thread):
     def setMode(self, modeToSet):
         # Check that the mode requested is not the same as the one active
         if self.mode != modeToSet:
-            self.mode = modeToSet
+            with self.modeLock:
+                self.mode = modeToSet
 
             # If there is a thread running, we want to wait until it stops
             if self.functionThread != "" and self.functionThread.isAlive():
@@ -104,58 +292,115 @@ class LightControl(threading.Thread):
                 print("Thread dead, continuing")
 
             # Create the thread depending on what function is requested
-            if self.mode == "flash":
+            self.functionThread = ""
+            if modeToSet == "flash":
                 self.functionThread = threading.Thread(target=self.flash)
-            elif self.mode == "strobe":
+            elif modeToSet == "strobe":
                 self.functionThread = threading.Thread(target=self.strobe)
-            elif self.mode == "fade":
+            elif modeToSet == "fade":
                 self.functionThread = threading.Thread(target=self.fade)
-            elif self.mode == "smooth":
+            elif modeToSet == "smooth":
                 self.functionThread = threading.Thread(target=self.smooth)
-            elif self.mode == "solid":
+            elif modeToSet == "solid":
                 self.functionThread = threading.Thread(target=self.solid)
+            elif modeToSet == "scene":
+                self.functionThread = threading.Thread(target=self.recall)
+            elif modeToSet == "dmx":
+                self.functionThread = threading.Thread(target=self.dmx)
                 
-            # Start the thread
-            self.functionThread.start()
+            # Start the thread, an empty mode has none
+            if self.functionThread != "":
+                self.functionThread.start()
+
+    # Fade to a recalled scene, then hand over to the effect it uses
+    def recall(self):
+        recallCount = self.recallCount
+        mode = self.scene["mode"]
+        duty = self.sceneDuty
+        start = self.fadeStart
+
+        steps = int(self.fadeTime / .01)
+        if steps > 0:
+            for step in range(1, steps + 1):
+                # Check if we have left the scene
+                if self.mode != "scene" or recallCount != self.recallCount:
+                    return
+
+                fadeMult = step / float(steps)
+                with self.frameLock:
+                    for i in range(len(duty)):
+                        self.pi.set_PWM_dutycycle(duty[i][0], start[i] + (duty[i][1] - start[i]) * fadeMult)
+                time.sleep(.01)
+
+        # Write the whole scene in one go, unless something replaced it
+        with self.modeLock:
+            if self.mode != "scene" or recallCount != self.recallCount:
+                return
+            with self.frameLock:
+                for pin, value in duty:
+                    self.pi.set_PWM_dutycycle(pin, value)
+            self.mode = mode
+
+        if mode == "flash":
+            self.flash()
+        elif mode == "strobe":
+            self.strobe()
+        elif mode == "fade":
+            self.fade()
+        elif mode == "smooth":
+            self.smooth()
+        elif mode == "solid":
+            self.solid()
+
+    # Follow the DMX input, writing only the channels that changed
+    def dmx(self):
+        self.dmxInput.active = True
+        self.dmxInput.requested = False
+        with self.frameLock:
+            self.dmxInput.applyAll(self.pi)
+        blackout = False
+        while self.mode == "dmx":
+            frameStart = time.time()
+            with self.frameLock:
+                if not self.enabled: # Check if the LEDs should be enabled or not
+                    if not blackout:
+                        for fixture in self.fixtures:
+                            for pin in fixture:
+                                self.pi.set_PWM_dutycycle(pin, 0)
+                        blackout = True
+                elif blackout:
+                    self.dmxInput.applyAll(self.pi)
+                    blackout = False
+                else:
+                    self.dmxInput.apply(self.pi)
+            time.sleep(max(0, self.dmxInput.frameTime - (time.time() - frameStart)))
+        self.dmxInput.active = False
 
     # Methods for the different color settings
     def solid(self):
-        rValTmp = 0
-        gValTmp = 0
-        bValTmp = 0
-        aValTmp = 0
-        aValMult = 0
-        first = True
+        lastValues = [-1] * (3 * len(self.fixtures)) # Write all pins when we start
+        startTime = time.time()
         while self.mode == "solid":
+            frameStart = time.time()
             if not self.enabled: # Check if the LEDs should be enabled or not
-                self.pi.set_PWM_dutycycle(self.pinR, 0)
-                self.pi.set_PWM_dutycycle(self.pinG, 0)
-                self.pi.set_PWM_dutycycle(self.pinB, 0)
-                first = False
+                frame = ""
             else:
-                if not first:
-                    aValMult = self.aVal / 255
-                    self.pi.set_PWM_dutycycle(self.pinR, self.rVal * aValMult)
-                    self.pi.set_PWM_dutycycle(self.pinG, self.gVal * aValMult)
-                    self.pi.set_PWM_dutycycle(self.pinB, self.bVal * aValMult)
-                    first = True
-                else:
-                    if rValTmp != self.rVal:
-                        self.pi.set_PWM_dutycycle(self.pinR, self.rVal * aValMult)
-                        rValTmp = self.rVal
-                    if gValTmp != self.gVal:
-                        self.pi.set_PWM_dutycycle(self.pinG, self.gVal * aValMult)
-                        gValTmp = self.gVal
-                    if bValTmp != self.bVal:
-                        self.pi.set_PWM_dutycycle(self.pinB, self.bVal * aValMult)
-                        bValTmp = self.bVal
-                    if aValTmp != self.aVal:
-                        aValMult = self.aVal / 255.0
-                        self.pi.set_PWM_dutycycle(self.pinR, self.rVal * aValMult)
-                        self.pi.set_PWM_dutycycle(self.pinG, self.gVal * aValMult)
-                        self.pi.set_PWM_dutycycle(self.pinB, self.bVal * aValMult)
-                        aValTmp = self.aVal
-                    time.sleep(.01)
+                self.layerStack.setMaster(self.aVal)
+                frame = self.layerStack.render(frameStart - startTime)
+
+            self.writeFrame(frame, lastValues)
+            time.sleep(max(0, .01 - (time.time() - frameStart)))
+
+    # Write one [r, g, b] per fixture, or all off for "", but only the pins
+    # that changed since the last frame
+    def writeFrame(self, frame, lastValues):
+        with self.frameLock:
+            for i in range(len(self.fixtures)):
+                for c in range(3):
+                    value = frame[i][c] if frame != "" else 0
+                    if lastValues[3 * i + c] != value:
+                        self.pi.set_PWM_dutycycle(self.fixtures[i][c], value)
+                        lastValues[3 * i + c] = value
 
     def flash(self):
         sleepTime = 0
@@ -164,6 +409,7 @@ class LightControl(threading.Thread):
                 self.pi.set_PWM_dutycycle(self.pinR, 0)
                 self.pi.set_PWM_dutycycle(self.pinG, 0)
                 self.pi.set_PWM_dutycycle(self.pinB, 0)
+                time.sleep(.01)
             else:
                 # Check if we have changed the alpha value
                 if sleepTime != (((self.aVal - 0) * (.5 - .1)) / (255 - 0) + .05):
@@ -320,6 +566,7 @@ class LightControl(threading.Thread):
                 self.pi.set_PWM_dutycycle(self.pinR, 0)
                 self.pi.set_PWM_dutycycle(self.pinG, 0)
                 self.pi.set_PWM_dutycycle(self.pinB, 0)
+                time.sleep(.01)
             else:
                 for strobeVal in range(0, 255, 1):
                     # Check if we have changed the alpha value
@@ -390,6 +637,7 @@ class LightControl(threading.Thread):
                 self.pi.set_PWM_dutycycle(self.pinR, 0)
                 self.pi.set_PWM_dutycycle(self.pinG, 0)
                 self.pi.set_PWM_dutycycle(self.pinB, 0)
+                time.sleep(.01)
             else:
                 for fadeVal in range(0, 255, 1):
                     # Check if we have changed the alpha value
@@ -560,6 +808,7 @@ class LightControl(threading.Thread):
                 self.pi.set_PWM_dutycycle(self.pinR, 0)
                 self.pi.set_PWM_dutycycle(self.pinG, 0)
                 self.pi.set_PWM_dutycycle(self.pinB, 0)
+                time.sleep(.01)
             else:
                 for smoothVal in range(0, 255, 1):
                     # Check if we have changed the alpha value
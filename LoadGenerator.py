@@ -0,0 +1,235 @@
+import argparse
+import os
+import random
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import Queue
+
+import ClientIngress
+import FakePi
+import LightControl
+
+# Simulates a number of clients speaking the 2_...; protocol and measures how
+# many commands the ingress and LightControl can keep up with. The clients
+# talk to a local TCP server that reads them the same way BluetoothConnection
+# does, and LightControl writes to a FakePi instead of the pins.
+#
+#   python LoadGenerator.py --clients 8 --duration 10 --patterns drag,flap
+
+PATTERNS = ("drag", "flap", "toggle", "malformed")
+
+# Odd, so multiplying by it spreads the sequence numbers over every 24 bit
+# color without two of them landing on the same one
+COLOR_STEP = 0x9E3779
+
+# LightControl that counts the commands it applied and notes when each of
+# them was applied
+class RecordingLightControl(LightControl.LightControl):
+    def __init__(self, pi, receiveQueue, stateQueue, stateFile, sceneFile):
+        LightControl.LightControl.__init__(self, pi, receiveQueue, stateQueue, stateFile=stateFile, sceneFile=sceneFile)
+        self.daemon = True
+        self.applied = {}
+        self.appliedCount = 0
+
+    def handleData(self, data):
+        if self.effectStopped.is_set():
+            return
+        LightControl.LightControl.handleData(self, data)
+        self.applied[data] = time.time()
+        self.appliedCount += 1
+
+# Reads commands from the load clients like BluetoothConnection reads them
+# from the phone, except every client is served at the same time
+class IngressServer(threading.Thread):
+    def __init__(self, lightQueue, rate, burst, policy):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.lightQueue = lightQueue
+        self.rate = rate
+        self.burst = burst
+        self.policy = policy
+        self.clientStats = {}
+        self.clientThreads = []
+        self.stopped = False
+
+        self.serverSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.serverSocket.bind(("127.0.0.1", 0))
+        self.serverSocket.listen(64)
+        self.address = self.serverSocket.getsockname()
+
+    def run(self):
+        while True:
+            clientSocket, address = self.serverSocket.accept()
+            clientThread = threading.Thread(target=self.serveClient, args=(clientSocket, address))
+            clientThread.daemon = True
+            clientThread.start()
+            self.clientThreads.append(clientThread)
+
+    # Stop reading from the clients and wait until every command the
+    # ingress held back is forwarded. Whatever the clients wrote that was
+    # not read yet is thrown away with their sockets
+    def stop(self):
+        self.stopped = True
+        for clientThread in self.clientThreads:
+            clientThread.join()
+
+    def serveClient(self, clientSocket, address):
+        stats = self.clientStats.setdefault(address, {})
+        ingress = ClientIngress.ClientIngress(self.lightQueue, stats, self.rate, self.burst, self.policy, verbose=False)
+        while not self.stopped:
+            ingress.waitForData(clientSocket)
+            try:
+                data = clientSocket.recv(1024)
+            except socket.error:
+                break
+
+            if len(data) == 0: break
+            ingress.receive(data)
+
+        ingress.close()
+        clientSocket.close()
+
+class LoadClient(threading.Thread):
+    def __init__(self, number, clients, pattern, address, rate, stop):
+        threading.Thread.__init__(self)
+        self.number = number
+        self.pattern = pattern
+        self.address = address
+        self.rate = rate
+        self.stop = stop
+        self.sent = {} # Send time of every color command, for latency
+        self.count = 0
+        self.clients = clients
+        self.sequence = number # Every client has its own sequence numbers
+        self.socket = socket.create_connection(address)
+        self.localAddress = self.socket.getsockname()
+
+    def send(self, data):
+        self.socket.sendall((data + ";").encode("utf-8"))
+        self.count += 1
+
+    # Every color command is a different color made from the sequence
+    # number, so each one can be told apart when it is applied. The colors
+    # are bright and at full alpha, so they go through the whole render and
+    # pin path
+    def sendColor(self):
+        self.sequence = (self.sequence + self.clients) % 0x1000000
+        data = "2_{:06x}ff".format(self.sequence * COLOR_STEP % 0x1000000)
+        self.sent[data] = time.time()
+        self.send(data)
+
+    def pace(self):
+        if self.rate > 0:
+            time.sleep(1.0 / self.rate)
+
+    def run(self):
+        try:
+            while not self.stop.is_set():
+                if self.pattern == "drag":
+                    # Bursts of colors, like a finger dragged over the color wheel
+                    for i in range(20):
+                        self.sendColor()
+                    if self.rate > 0:
+                        time.sleep(20.0 / self.rate)
+                elif self.pattern == "flap":
+                    self.send("2_" + random.choice("GHIJ") + "00000{:02x}".format(random.randint(0, 255)))
+                    self.pace()
+                elif self.pattern == "toggle":
+                    self.send("2_K00000000" if self.count % 2 == 0 else "2_L00000000")
+                    self.pace()
+                else:
+                    self.send(random.choice(["2_", "2_ZZZZZZZZ", "2_G", "2", "xx_1234567890", "2_N", "0_C0000000", "0_B0000000"]))
+                    self.pace()
+        except socket.error as e:
+            print("Client ", self.number, " disconnected: ", e)
+        self.socket.close()
+
+def percentile(values, percent):
+    if len(values) == 0:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * percent / 100.0))]
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the command ingress and LightControl")
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--patterns", default=",".join(PATTERNS), help="Comma separated, handed out to the clients in turn")
+    parser.add_argument("--send-rate", type=float, default=0, help="Commands per second per client, 0 for as fast as possible")
+    parser.add_argument("--rate", type=float, default=50, help="Ingress token bucket rate")
+    parser.add_argument("--burst", type=float, default=20, help="Ingress token bucket size")
+    parser.add_argument("--policy", default=ClientIngress.COALESCE,
+                        choices=[ClientIngress.COALESCE, ClientIngress.DROP_OLDEST, ClientIngress.PAUSE])
+    args = parser.parse_args()
+
+    patterns = args.patterns.split(",")
+    for pattern in patterns:
+        if pattern not in PATTERNS:
+            parser.error("Unknown pattern " + pattern)
+
+    pi = FakePi.FakePi()
+    lightQueue = Queue.Queue(64)
+    stateQueue = Queue.Queue()
+    # Keep the state and scenes of the device out of the test
+    tempDir = tempfile.mkdtemp()
+    lightControl = RecordingLightControl(pi, lightQueue, stateQueue, os.path.join(tempDir, "lightstate.txt"),
+                                         os.path.join(tempDir, "scenes.json"))
+    lightControl.start()
+    lightControl.lightReady.wait()
+
+    server = IngressServer(lightQueue, args.rate, args.burst, args.policy)
+    server.start()
+
+    stop = threading.Event()
+    clients = [LoadClient(i, args.clients, patterns[i % len(patterns)], server.address, args.send_rate, stop) for i in range(args.clients)]
+    startTime = time.time()
+    for client in clients:
+        client.start()
+    time.sleep(args.duration)
+    stop.set()
+    elapsed = time.time() - startTime
+    server.stop()
+    for client in clients:
+        client.join()
+
+    # Let the light thread apply what is still queued, then stop the
+    # running effect from the light thread itself
+    while not lightQueue.empty():
+        time.sleep(.01)
+    lightQueue.put("0_C0000000")
+    lightControl.effectStopped.wait(10)
+    shutil.rmtree(tempDir)
+
+    # Only count what was read, what the clients wrote beyond that only
+    # ever reached the socket buffers
+    received = sum(stats.get("received", 0) for stats in server.clientStats.values())
+    forwarded = sum(stats.get("forwarded", 0) for stats in server.clientStats.values())
+    applied = lightControl.appliedCount
+    latencies = []
+    for client in clients:
+        for data, sentTime in client.sent.items():
+            if data in lightControl.applied:
+                latencies.append((lightControl.applied[data] - sentTime) * 1000)
+    latencies.sort()
+    writes = pi.counts["set_PWM_dutycycle"]
+
+    print("")
+    print("Clients: {} ({}), {:.1f} s, policy {}".format(args.clients, args.patterns, elapsed, args.policy))
+    print("Received by the ingress: {} commands ({:.0f}/s)".format(received, received / elapsed))
+    print("Forwarded to LightControl: {} commands ({:.0f}/s)".format(forwarded, forwarded / elapsed))
+    print("Applied by LightControl: {} commands ({:.0f}/s)".format(applied, applied / elapsed))
+    print("Latency of applied colors (n={}): p50 {:.1f} ms, p90 {:.1f} ms, p99 {:.1f} ms, max {:.1f} ms".format(
+        len(latencies), percentile(latencies, 50), percentile(latencies, 90), percentile(latencies, 99),
+        percentile(latencies, 100)))
+    print("Pin writes: {} ({:.0f}/s)".format(writes, writes / elapsed))
+    print("Per client:")
+    for client in clients:
+        stats = server.clientStats.get(client.localAddress, {})
+        print("  {:>3} {:<10} written {:>7} {}".format(client.number, client.pattern, client.count,
+              " ".join("{} {}".format(name, stats.get(name, 0))
+                       for name in ("received", "forwarded", "coalesced", "dropped", "paused", "refused"))))
+
+if __name__ == '__main__':
+    main()
@@ -1,21 +1,85 @@
-import threading
+import time
+startTime = time.time()
+
+import sys
+import Queue
 import pigpio
-import multiprocessing
 
-import BluetoothConnection
 import LightControl
 
 class Controller():
-    def __init__(self):
+    def __init__(self, report=False, pixels=0, chip="ws2812", spidev=False, dmxUniverse=0, dmxAddress=1,
+                 rate=50, burst=20, policy="coalesce"):
         self.pi = pigpio.pi()
-        
-        self.lightQueue = multiprocessing.Queue()
-        self.stateQueue = multiprocessing.Queue()
-        
-        self.bluetoothConnection = BluetoothConnection.BluetoothConnection(self.lightQueue, self.stateQueue)
-        self.lightControl = LightControl.LightControl(self.pi, self.lightQueue, self.stateQueue)        
-        self.bluetoothConnection.start()
+
+        # Drive an addressable strip instead of the PWM pins
+        fixtures = None
+        if pixels > 0:
+            import PixelStrip
+            spi = PixelStrip.SpidevSink() if spidev else None
+            self.pixelStrip = PixelStrip.PixelStrip(self.pi, pixels, chip, spi=spi)
+            self.pixelStrip.start()
+            self.pi = self.pixelStrip
+            fixtures = self.pixelStrip.fixtures()
+
+        # Both threads live in this process, so a plain Queue is enough
+        self.lightQueue = Queue.Queue(64) # Bounded so a flooding client cannot grow memory
+        self.stateQueue = Queue.Queue()
+
+        # Bring the lights up first so the last state is restored as soon
+        # as possible, then bring up bluetooth while the lights are running
+        self.lightControl = LightControl.LightControl(self.pi, self.lightQueue, self.stateQueue, fixtures)
+
+        # Let lighting consoles drive the fixtures over Art-Net/sACN
+        if dmxUniverse > 0:
+            import DmxInput
+            self.dmxInput = DmxInput.DmxInput(self.lightQueue, self.lightControl.fixtures, dmxUniverse, dmxAddress, dmxUniverse - 1)
+            self.lightControl.dmxInput = self.dmxInput
+            self.dmxInput.start()
+
         self.lightControl.start()
 
+        import BluetoothConnection
+        self.bluetoothConnection = BluetoothConnection.BluetoothConnection(self.lightQueue, self.stateQueue, rate, burst, policy)
+        self.bluetoothConnection.start()
+
+        if report:
+            self.report()
+
+    # Print how long startup took and how much memory we are using
+    def report(self):
+        self.lightControl.lightReady.wait(30)
+        lightTime = time.time() - startTime
+        self.bluetoothConnection.ready.wait(30)
+        bluetoothTime = time.time() - startTime
+
+        # Let the effect threads settle before measuring memory
+        time.sleep(5)
+        rss = ""
+        peak = ""
+        try:
+            with open("/proc/self/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        rss = line.split(":")[1].strip()
+                    elif line.startswith("VmHWM:"):
+                        peak = line.split(":")[1].strip()
+        except (IOError, OSError):
+            pass
+
+        print("Startup report:")
+        print("  Time to first light: {:.3f} s".format(lightTime))
+        print("  Time to bluetooth ready: {:.3f} s".format(bluetoothTime))
+        print("  Steady-state RSS: " + rss)
+        print("  Peak RSS: " + peak)
+
+# Value given after an option on the command line, like --pixels 300
+def option(name, default):
+    if name in sys.argv and sys.argv.index(name) + 1 < len(sys.argv):
+        return sys.argv[sys.argv.index(name) + 1]
+    return default
+
 if __name__ == '__main__':
-    controller = Controller()
+    controller = Controller("--report" in sys.argv, int(option("--pixels", 0)), option("--chip", "ws2812"), "--spidev" in sys.argv,
+                            int(option("--dmx-universe", 0)), int(option("--dmx-address", 1)),
+                            float(option("--rate", 50)), float(option("--burst", 20)), option("--policy", "coalesce"))
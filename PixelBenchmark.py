@@ -0,0 +1,113 @@
+import sys
+import time
+
+import FakePi
+import LayerStack
+import LightControl
+import PixelStrip
+
+# Measures how many frames per second a pixel strip can be driven at through
+# the same path Main uses: LightControl composites its layers and writes the
+# changed virtual pins to PixelStrip, which sends the frame to a FakePi as the
+# SPI sink. Wire time is not included, at 2.4 MHz a WS2812 frame of 1200
+# pixels takes 36 ms to clock out
+#
+#   python PixelBenchmark.py [seconds per run]
+
+SIZES = (150, 600, 1200)
+EFFECTS = ("rainbow", "solid", "pins")
+
+# A rainbow layer changes every pixel in every frame, solid changes the
+# solid color in every frame like a finger on the color wheel, and pins
+# sets the whole strip through pins 17/27/22 like the older effects do
+def prepare(lightControl, effect):
+    if effect == "rainbow":
+        lightControl.layerStack.layers[0] = LayerStack.Layer(LayerStack.RAINBOW, [(0, 0, 0)], speed=64)
+
+def render(lightControl, effect, frame):
+    if effect == "pins":
+        return None
+    if effect == "solid":
+        color = (frame % 256, 255 - frame % 256, 128)
+        lightControl.layerStack.layers[0] = LayerStack.Layer(LayerStack.SOLID, [color])
+    return lightControl.layerStack.render(frame / 100.0)
+
+def write(lightControl, strip, effect, frame, rendered, lastValues):
+    if effect == "pins":
+        strip.set_PWM_dutycycle(lightControl.pinR, frame % 256)
+        strip.set_PWM_dutycycle(lightControl.pinG, 255 - frame % 256)
+        strip.set_PWM_dutycycle(lightControl.pinB, 128)
+    else:
+        lightControl.writeFrame(rendered, lastValues)
+    strip.show()
+
+def setup(chip, count, effect):
+    pi = FakePi.FakePi(history=10)
+    strip = PixelStrip.PixelStrip(pi, count, chip)
+    lightControl = LightControl.LightControl(strip, None, None, strip.fixtures()) # Never started, so it needs no queues
+    prepare(lightControl, effect)
+    return strip, lightControl, [-1] * (3 * count)
+
+def benchmark(chip, count, effect, seconds):
+    strip, lightControl, lastValues = setup(chip, count, effect)
+    frames = 0
+    startTime = time.time()
+    while time.time() - startTime < seconds:
+        write(lightControl, strip, effect, frames, render(lightControl, effect, frames), lastValues)
+        frames += 1
+    return frames / (time.time() - startTime)
+
+# Most bytes allocated at once while a composited frame is written to the
+# strip and sent, where tracemalloc is available. It stays the same for any
+# number of pixels when nothing is allocated per pixel
+def allocated(chip, count, effect):
+    try:
+        import tracemalloc
+    except ImportError:
+        return None
+    strip, lightControl, lastValues = setup(chip, count, effect)
+    # The first frame sizes the buffer of the SPI sink
+    write(lightControl, strip, effect, 0, render(lightControl, effect, 0), lastValues)
+    peak = 0
+    for frame in range(1, 21):
+        rendered = render(lightControl, effect, frame)
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        write(lightControl, strip, effect, frame, rendered, lastValues)
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - before)
+        tracemalloc.stop()
+    return peak
+
+# Resident memory in kB, to see it stays flat while frames are sent
+def residentMemory():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except (IOError, OSError):
+        pass
+    return None
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 2
+    results = []
+    for chip in (PixelStrip.WS2812, PixelStrip.APA102):
+        for effect in EFFECTS:
+            for count in SIZES:
+                fps = benchmark(chip, count, effect, seconds) # Once to settle the memory
+                before = residentMemory()
+                fps = benchmark(chip, count, effect, seconds)
+                after = residentMemory()
+                growth = None if before is None or after is None else after - before
+                results.append((chip, effect, count, fps, allocated(chip, count, effect), growth))
+
+    print("")
+    print("{:<8} {:<8} {:>6} {:>10} {:>18} {:>14}".format("chip", "effect", "pixels", "fps", "strip bytes/frame", "RSS growth kB"))
+    for chip, effect, count, fps, peak, growth in results:
+        print("{:<8} {:<8} {:>6} {:>10.1f} {:>18} {:>14}".format(chip, effect, count, fps,
+              "n/a" if peak is None else peak, "n/a" if growth is None else growth))
+    print("Strip bytes/frame is the most allocated at once while writing and sending a frame, it needs tracemalloc")
+
+if __name__ == '__main__':
+    main()
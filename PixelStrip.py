@@ -0,0 +1,228 @@
+import threading
+import time
+
+WS2812 = "ws2812"
+APA102 = "apa102"
+
+# Pixels are also reachable as virtual pins, so anything that drives pins
+# through set_PWM_dutycycle can drive single pixels. Pixel i has its red,
+# green and blue at PIXEL_PIN_BASE + 3 * i + 0, 1 and 2
+PIXEL_PIN_BASE = 1000
+
+# WS2812 over SPI at 2.4 MHz: every data bit is sent as three SPI bits,
+# 110 for a one and 100 for a zero
+WS2812_BAUD = 2400000
+WS2812_RESET = 24 # Zero bytes after a frame, more than the 50 us latch time
+APA102_BAUD = 8000000
+
+# Drives an addressable strip over SPI. The strip looks like a pigpio.pi to
+# LightControl: the red, green and blue pins set the color of the whole strip,
+# and every pixel has its own virtual pins. Everything is rendered straight
+# into a preallocated buffer in the format the strip wants, and a frame is
+# sent with a single SPI write. Writers that change several pixels for one
+# frame hold frameLock meanwhile, so a frame never goes out half written
+class PixelStrip(threading.Thread):
+    def __init__(self, pi, count, chip=WS2812, order=None, brightness=255, channel=0, baud=None, fps=60, spi=None, stripPins=(17, 27, 22)):
+        print("Initializing PixelStrip thread")
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.pi = pi
+        self.spi = spi if spi is not None else pi
+        self.count = count
+        self.chip = chip
+        self.fps = fps
+        self.dirty = True
+        self.frameLock = threading.RLock()
+
+        if order is None:
+            order = "BGR" if chip == APA102 else "GRB"
+        # Where red, green and blue go within a pixel on the wire
+        self.offsetR = order.index("R")
+        self.offsetG = order.index("G")
+        self.offsetB = order.index("B")
+        self.offsets = (self.offsetR, self.offsetG, self.offsetB)
+
+        # The pins that set the color of the whole strip
+        self.stripPins = {stripPins[0]: 0, stripPins[1]: 1, stripPins[2]: 2}
+        self.color = [0, 0, 0]
+
+        # The colors as they were set, before brightness
+        self.pixels = bytearray(3 * count)
+        self.pixelsView = memoryview(self.pixels)
+
+        # The frame as it goes out on the wire
+        if chip == APA102:
+            self.pixelSize = 4
+            self.headerSize = 4 # Start frame of 32 zero bits
+            end = (count + 15) // 16 # End frame of at least count / 2 one bits
+            self.wire = bytearray(self.headerSize + self.pixelSize * count + end)
+            for i in range(self.headerSize + self.pixelSize * count, len(self.wire)):
+                self.wire[i] = 0xFF
+            if baud is None:
+                baud = APA102_BAUD
+        else:
+            self.pixelSize = 9
+            self.headerSize = 1 # Keep the line low before the first bit
+            self.wire = bytearray(self.headerSize + self.pixelSize * count + WS2812_RESET)
+            if baud is None:
+                baud = WS2812_BAUD
+        self.wireView = memoryview(self.wire)
+        # The frame being sent, so writers can carry on while it goes out
+        self.front = bytearray(len(self.wire))
+
+        self.encoded = [bytearray(3) for i in range(256)]
+        self.setBrightness(brightness)
+
+        self.handle = self.spi.spi_open(channel, baud, 0)
+
+        print("PixelStrip thread initialized")
+
+    def run(self):
+        print("Starting PixelStrip thread")
+        frameTime = 1.0 / self.fps
+        while True:
+            frameStart = time.time()
+            if self.dirty:
+                self.show()
+            time.sleep(max(0, frameTime - (time.time() - frameStart)))
+
+    # Send the frame to the strip
+    def show(self):
+        with self.frameLock:
+            self.dirty = False
+            self.front[:] = self.wire
+        self.spi.spi_write(self.handle, self.front)
+
+    def setBrightness(self, brightness):
+        with self.frameLock:
+            self.brightness = brightness
+            if self.chip == APA102:
+                # The APA102 has a 5 bit global brightness in every pixel
+                header = 0xE0 | (brightness >> 3)
+                for i in range(self.count):
+                    self.wire[self.headerSize + self.pixelSize * i] = header
+            else:
+                # Scale while encoding, so brightness costs nothing per frame
+                for value in range(256):
+                    scaled = value * brightness // 255
+                    bits = 0
+                    for bit in range(7, -1, -1):
+                        bits = (bits << 3) | (6 if (scaled >> bit) & 1 else 4)
+                    self.encoded[value][0] = (bits >> 16) & 0xFF
+                    self.encoded[value][1] = (bits >> 8) & 0xFF
+                    self.encoded[value][2] = bits & 0xFF
+                for i in range(self.count):
+                    self.encodePixel(i)
+            self.dirty = True
+
+    def setPixel(self, index, red, green, blue):
+        with self.frameLock:
+            p = 3 * index
+            self.pixels[p] = int(red)
+            self.pixels[p + 1] = int(green)
+            self.pixels[p + 2] = int(blue)
+            self.encodePixel(index)
+            self.dirty = True
+
+    def getPixel(self, index):
+        p = 3 * index
+        return self.pixels[p], self.pixels[p + 1], self.pixels[p + 2]
+
+    def encodePixel(self, index):
+        p = 3 * index
+        o = self.headerSize + self.pixelSize * index
+        if self.chip == APA102:
+            self.wire[o + 1 + self.offsetR] = self.pixels[p]
+            self.wire[o + 1 + self.offsetG] = self.pixels[p + 1]
+            self.wire[o + 1 + self.offsetB] = self.pixels[p + 2]
+        else:
+            r = o + 3 * self.offsetR
+            g = o + 3 * self.offsetG
+            b = o + 3 * self.offsetB
+            self.wire[r:r + 3] = self.encoded[self.pixels[p]]
+            self.wire[g:g + 3] = self.encoded[self.pixels[p + 1]]
+            self.wire[b:b + 3] = self.encoded[self.pixels[p + 2]]
+
+    # Encode a single channel, p is the index into pixels
+    def encodeChannel(self, p):
+        o = self.headerSize + self.pixelSize * (p // 3)
+        offset = self.offsets[p % 3]
+        if self.chip == APA102:
+            self.wire[o + 1 + offset] = self.pixels[p]
+        else:
+            o += 3 * offset
+            self.wire[o:o + 3] = self.encoded[self.pixels[p]]
+
+    # Set every pixel to the same color. The first pixel is copied onto the
+    # rest in doubling chunks, so this takes log2(count) copies
+    def fill(self, red, green, blue):
+        with self.frameLock:
+            self.setPixel(0, red, green, blue)
+            self.repeat(self.pixelsView, 0, 3)
+            self.repeat(self.wireView, self.headerSize, self.pixelSize)
+
+    def repeat(self, view, start, size):
+        total = size * self.count
+        filled = size
+        while filled < total:
+            chunk = min(filled, total - filled)
+            view[start + filled:start + filled + chunk] = view[start:start + chunk]
+            filled += chunk
+
+    # Virtual pins of every pixel, to use as LightControl fixtures
+    def fixtures(self):
+        return [tuple(PIXEL_PIN_BASE + 3 * i + c for c in range(3)) for i in range(self.count)]
+
+    # The part of pigpio.pi that LightControl uses
+    def set_mode(self, gpio, mode):
+        if gpio not in self.stripPins and gpio < PIXEL_PIN_BASE:
+            self.pi.set_mode(gpio, mode)
+
+    def set_PWM_frequency(self, gpio, frequency):
+        if gpio not in self.stripPins and gpio < PIXEL_PIN_BASE:
+            return self.pi.set_PWM_frequency(gpio, frequency)
+        return self.fps
+
+    def set_PWM_dutycycle(self, gpio, dutycycle):
+        if gpio in self.stripPins:
+            self.color[self.stripPins[gpio]] = int(dutycycle)
+            self.fill(self.color[0], self.color[1], self.color[2])
+        elif gpio >= PIXEL_PIN_BASE:
+            p = gpio - PIXEL_PIN_BASE
+            with self.frameLock:
+                self.pixels[p] = int(dutycycle)
+                self.encodeChannel(p)
+                self.dirty = True
+        else:
+            self.pi.set_PWM_dutycycle(gpio, dutycycle)
+
+    def get_PWM_dutycycle(self, gpio):
+        if gpio in self.stripPins:
+            return self.color[self.stripPins[gpio]]
+        elif gpio >= PIXEL_PIN_BASE:
+            return self.pixels[gpio - PIXEL_PIN_BASE]
+        return self.pi.get_PWM_dutycycle(gpio)
+
+# Sends frames through the spidev kernel driver instead of pigpio, with the
+# same calls as pigpio so PixelStrip can use either
+class SpidevSink():
+    def __init__(self, bus=0):
+        import spidev
+        self.spidev = spidev
+        self.bus = bus
+        self.devices = []
+
+    def spi_open(self, channel, baud, flags):
+        device = self.spidev.SpiDev()
+        device.open(self.bus, channel)
+        device.max_speed_hz = baud
+        device.mode = flags & 3
+        self.devices.append(device)
+        return len(self.devices) - 1
+
+    def spi_write(self, handle, data):
+        self.devices[handle].writebytes2(data)
+        return len(data)
+
+    def spi_close(self, handle):
+        self.devices[handle].close()
@@ -0,0 +1,108 @@
+import json
+import os
+
+import LayerStack
+
+# The first frame each effect shows, so a crossfade ends where the effect starts
+START_FRAMES = {
+    "flash": (255, 0, 0),
+    "smooth": (255, 0, 0)
+}
+
+# What every stored scene and every layer in it has to have
+SCENE_KEYS = ("mode", "color", "alpha", "enabled", "fixtures")
+LAYER_KEYS = ("effect", "colors", "opacity", "blend", "speed")
+
+class SceneStore():
+    def __init__(self, path, fixtures):
+        self.path = path
+        self.fixtures = fixtures # List of (pinR, pinG, pinB), one per fixture
+        self.scenes = {}
+        self.compiled = {}
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except (IOError, OSError, ValueError):
+            saved = {}
+        if not isinstance(saved, dict):
+            print("Ignoring scenes that are not stored by number")
+            saved = {}
+
+        # A broken scene is skipped, so it cannot take the others with it
+        for number, scene in saved.items():
+            try:
+                self.checkScene(scene)
+                compiled = self.compileScene(scene)
+                self.scenes[int(number)] = scene
+                self.compiled[int(number)] = compiled
+            except (ValueError, KeyError, TypeError, IndexError, AttributeError) as e:
+                print("Ignoring bad scene: ", number, repr(e))
+        print("Scenes loaded: ", sorted(self.scenes.keys()))
+
+    # Make sure a scene read from disk has everything recalling it needs
+    def checkScene(self, scene):
+        for key in SCENE_KEYS:
+            if key not in scene:
+                raise KeyError(key)
+        for layer in scene.get("layers", {}).values():
+            for key in LAYER_KEYS:
+                if key not in layer:
+                    raise KeyError(key)
+
+    def save(self):
+        try:
+            with open(self.path + ".tmp", "w") as f:
+                json.dump(dict((str(number), scene) for number, scene in self.scenes.items()), f)
+            os.rename(self.path + ".tmp", self.path)
+        except (IOError, OSError) as e:
+            print("Could not save scenes: ", e)
+
+    def store(self, number, scene):
+        self.scenes[number] = scene
+        self.compiled[number] = self.compileScene(scene)
+        self.save()
+
+    def get(self, number):
+        if number not in self.scenes:
+            return None
+        return self.scenes[number], self.compiled[number]
+
+    # The layers solid composites for a scene, from the bottom up. The bottom
+    # one is the solid color, which scenes of other effects do not have
+    def layers(self, scene, slots):
+        layers = [None] * slots
+        if scene["mode"] == "solid":
+            colors = scene["fixtures"]
+            if len(colors) != len(self.fixtures):
+                colors = [scene["color"]]
+            layers[0] = LayerStack.Layer(LayerStack.SOLID, colors)
+
+        stored = scene.get("layers", {})
+        for slot in range(1, slots):
+            layer = stored.get(str(slot))
+            if layer is not None:
+                layers[slot] = LayerStack.Layer(layer["effect"], layer["colors"], layer["opacity"],
+                                                layer["blend"], layer["speed"])
+        return layers
+
+    # Work out the dutycycle of every pin up front, so recalling the scene
+    # is only a matter of writing them out
+    def compileScene(self, scene):
+        duty = []
+        if scene["enabled"] and scene["mode"] == "solid":
+            # The first frame solid shows, with the layers of the scene on top
+            layerStack = LayerStack.LayerStack(len(self.fixtures))
+            layerStack.layers = self.layers(scene, len(layerStack.layers))
+            layerStack.setMaster(scene["alpha"])
+            frame = layerStack.render(0)
+        for i in range(len(self.fixtures)):
+            if not scene["enabled"]:
+                values = (0, 0, 0)
+            elif scene["mode"] == "solid":
+                values = frame[i]
+            else:
+                values = START_FRAMES.get(scene["mode"], (0, 0, 0))
+            duty.extend(zip(self.fixtures[i], values))
+        return duty